@@ -2,6 +2,7 @@
 
 from openai import OpenAI
 from dotenv import load_dotenv
+import json
 import os
 
 # Load environment variables from openAI_Key.env
@@ -113,25 +114,48 @@ class AIProcessor:
         }
         return emoji_map.get(tag, "")
 
-    def generate_todo_list(self, emails, max_items=5):
+    def extract_action_items(self, emails):
         """
-        Generate a concise To-Do list based on the most recent emails.
+        Extract action items for a batch of emails in a single call.
+        Returns (email, items) pairs only for the emails the model answered,
+        so any it skipped stay pending and are retried later.
         """
-        # Build the prompt with up to 10 email summaries
-        prompt = f"Here are the recent email summaries. Extract the top {max_items} action items as a numbered list (one per line):\n\n"
-        for idx, email in enumerate(emails[:10], start=1):
-            snippet = email['body'][:150].replace('\n', ' ')
+        prompt = (
+            "For each email below, list the concrete action items the recipient should take "
+            "(short imperative sentences). Use an empty list when there is nothing to do.\n\n"
+        )
+        for idx, email in enumerate(emails, start=1):
+            snippet = email['body'][:300].replace('\n', ' ')
             prompt += (
-                f"{idx}. From: {email['sender']}, Subject: {email['subject']}, "
-                f"Snippet: {snippet}...\n"
+                f"Email {idx}:\nFrom: {email['sender']}\n"
+                f"Subject: {email['subject']}\n"
+                f"Snippet: {snippet}...\n\n"
             )
         prompt += (
-            "\nPlease return only the numbered To-Do list, for example:\n"
-            "1. Reply to Alice about the project update\n"
-            "2. Schedule a meeting with Bob regarding the budget\n"
+            'Return action items in JSON format:\n'
+            '{"emails": [{"email_index": 1, "actions": ["Reply to Alice about the project update"]}, ...]}'
         )
 
-        # Reuse the existing query_openai method
-        return self.query_openai(prompt, "")
-
-
+        resp = self.client.chat.completions.create(
+            model="gpt-4o-mini-2024-07-18",
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant that extracts To-Do items from emails."},
+                {"role": "user", "content": prompt}
+            ],
+            response_format={"type": "json_object"},
+            temperature=0.3
+        )
+        parsed = json.loads(resp.choices[0].message.content).get("emails", [])
+        if not isinstance(parsed, list):
+            raise ValueError("Unexpected action item format from model")
+
+        items_by_index = {}
+        for entry in parsed:
+            if not isinstance(entry, dict):
+                continue
+            index = entry.get("email_index")
+            actions = entry.get("actions")
+            if isinstance(index, int) and 1 <= index <= len(emails) and isinstance(actions, list):
+                items_by_index[index - 1] = [a.strip() for a in actions if isinstance(a, str) and a.strip()]
+
+        return [(emails[i], items) for i, items in sorted(items_by_index.items())]
@@ -1,20 +1,28 @@
 # server/background.py
 
+import hmac
 import threading
 import time
 import os
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
 
 # Import Gmail and AI processing modules
 from gmail_connector import GmailConnector
 from ai_processor import AIProcessor
 from email_classifier import EmailClassifier  # Import the new module
+from todo_store import TodoStore
+from request_profiler import RequestProfiler, stage
 
 app = Flask(__name__)
 CORS(app)
 
+# Opt-in slow-request profiling (PROFILE_REQUESTS=1)
+request_profiler = RequestProfiler.from_env()
+if request_profiler:
+    request_profiler.init_app(app)
+
 # Global service instances and email cache
 gmail_connector = None
 ai_processor = None
@@ -23,8 +31,12 @@ email_cache = []
 last_fetch_time = 0
 classified_emails = []  # Cache for classified emails
 
-todo_cache = []
-last_todo_time = 0
+todo_store = TodoStore()
+todo_lock = threading.Lock()
+
+# Only the newest emails are scanned for action items, in batches
+TODO_SCAN_EMAILS = 20
+TODO_BATCH_SIZE = 10
 
 
 def initialize_services():
@@ -52,15 +64,17 @@ def initialize_services():
     refresh_email_cache()
 
 
-def refresh_email_cache():
+def refresh_email_cache(force=False):
     """
-    Refresh email cache if more than 5 minutes have passed since last fetch.
+    Refresh email cache if more than 5 minutes have passed since last fetch,
+    or immediately when `force` is set.
+    Returns the background classification thread, or None if nothing was fetched.
     """
     global email_cache, last_fetch_time, classified_emails
 
     now = time.time()
-    if now - last_fetch_time < 300:
-        return
+    if not force and now - last_fetch_time < 300:
+        return None
 
     try:
         email_cache = gmail_connector.get_recent_emails(max_emails=100)
@@ -68,55 +82,65 @@ def refresh_email_cache():
         print(f"Email cache refreshed: {len(email_cache)} emails")
         
         # Classify emails in a non-blocking way
-        threading.Thread(target=classify_emails_background).start()
+        classify_thread = threading.Thread(target=classify_emails_background)
+        classify_thread.start()
+        return classify_thread
         
     except Exception as e:
         print(f"Error refreshing email cache: {e}")
+        return None
 
-def refresh_todo_cache():
+def update_todo_store():
     """
-    Generate and cache To-Do items based on latest emails.
-    Refreshes only if cache is older than 5 minutes.
+    Extract action items from recent emails not seen before.
+    Each message is sent to the LLM once; results are persisted by message id.
     """
-    global todo_cache, last_todo_time
-
-    now = time.time()
-    # Reuse cache if it was updated within the last 5 minutes
-    if now - last_todo_time < 300 and todo_cache:
-        return
-
-    # Ensure email cache is up‐to‐date
-    refresh_email_cache()
-
-    # Prepare email list for To-Do generation
-    emails = []
-    for e in email_cache[:10]:
-        classified = next((c for c in classified_emails if c["id"] == e["id"]), None)
-        emails.append(classified or e)
-
-    # Call AIProcessor to generate raw To-Do text
-    raw_output = ai_processor.generate_todo_list(emails, max_items=5)
-    # Split lines and filter out empty entries
-    todos = [line.strip() for line in raw_output.splitlines() if line.strip()]
-
-    # Update cache
-    todo_cache = todos
-    last_todo_time = now
+    # Serialize extraction so concurrent refreshes don't process the same emails twice
+    with todo_lock:
+        # Only use emails the background classifier has tagged; the rest are
+        # picked up after its next pass so tag and spam flag are never stale
+        emails = []
+        for e in email_cache[:TODO_SCAN_EMAILS]:
+            classified = next((c for c in classified_emails if c["id"] == e["id"]), None)
+            if classified:
+                emails.append(classified)
+
+        todo_store.update_labels(emails)
+        pending = todo_store.pending(emails)
+        extracted = 0
+        for start in range(0, len(pending), TODO_BATCH_SIZE):
+            batch = pending[start:start + TODO_BATCH_SIZE]
+            try:
+                # Emails the model skipped are not returned and stay pending
+                results = ai_processor.extract_action_items(batch)
+                todo_store.add(results)
+                extracted += len(results)
+            except Exception as e:
+                # Leave the batch pending so it is retried on the next refresh
+                print(f"Error extracting action items: {e}")
+
+        if extracted:
+            print(f"Extracted action items from {extracted} new emails")
 
 def classify_emails_background():
     """Background task to classify emails"""
     global email_cache, classified_emails
     try:
         # Only classify the first 20 emails to save API costs
-        classified_emails = email_classifier.classify_emails(email_cache, max_emails=20)
+        classified = email_classifier.classify_emails(email_cache, max_emails=20)
 
-        # Add spam detection field
-        for email in classified_emails:
+        # Add spam detection field before publishing the results
+        for email in classified:
             email["is_spam"] = email_classifier.is_spam(email)
 
+        classified_emails = classified
         print(f"Classified {len(classified_emails)} emails")
     except Exception as e:
         print(f"Error classifying emails: {e}")
+        return
+
+    # Extract To-Do items after classification so tags are available for ranking
+    update_todo_store()
 
 
 @app.route('/api/health', methods=['GET'])
@@ -138,7 +162,8 @@ def process_query():
         return jsonify({'error': 'No query provided'}), 400
 
     # Ensure email cache is up-to-date
-    refresh_email_cache()
+    with stage("refresh_email_cache"):
+        refresh_email_cache()
 
     # Spam filtering path
     # q_lower = query.lower()
@@ -163,34 +188,39 @@ def process_query():
 
     else:
         # General keyword-based email search
-        relevant = ai_processor.search_emails(email_cache, query)
-        if not relevant:
+        with stage("search_emails"):
+            relevant = ai_processor.search_emails(email_cache, query)
+            if not relevant:
 
-            relevant = email_cache[:10]
+                relevant = email_cache[:10]
             
         # Try to use classified emails if available
         emails_to_use = []
-        for email in relevant:
-            # Look for the classified version of this email
-            classified_version = next(
-                (e for e in classified_emails if e["id"] == email["id"]), 
-                None
-            )
-            if classified_version:
-                emails_to_use.append(classified_version)
-            else:
-                emails_to_use.append(email)
+        with stage("merge_classified"):
+            for email in relevant:
+                # Look for the classified version of this email
+                classified_version = next(
+                    (e for e in classified_emails if e["id"] == email["id"]), 
+                    None
+                )
+                if classified_version:
+                    emails_to_use.append(classified_version)
+                else:
+                    emails_to_use.append(email)
                 
-        context = ai_processor.prepare_context(emails_to_use, query)
+        with stage("prepare_context"):
+            context = ai_processor.prepare_context(emails_to_use, query)
 
-        answer = ai_processor.query_openai(context, query)
+        with stage("query_openai"):
+            answer = ai_processor.query_openai(context, query)
 
     return jsonify({'answer': answer})
 
 
 @app.route('/api/emails', methods=['GET'])
 def get_emails():
-    refresh_email_cache()
+    with stage("refresh_email_cache"):
+        refresh_email_cache()
 
     top_ids = [e["id"] for e in email_cache[:10]]
     emails_to_return = []
@@ -216,22 +246,63 @@ def get_emails():
 @app.route('/api/todos', methods=['GET'])
 def get_todo_list():
     """
-    Return cached To-Do items, regenerating if cache expired or if force-refresh is requested.
+    Return the top To-Do items assembled from the local store.
+    With ?refresh=true, first fetch new mail and wait for it to be classified
+    and its action items extracted.
     """
     # Check for manual refresh flag in query string
     force_refresh = request.args.get('refresh', 'false').lower() == 'true'
-    if force_refresh:
-        # Invalidate cache timestamp so refresh_todo_cache() will regenerate
-        global last_todo_time
-        last_todo_time = 0
 
     try:
-        refresh_todo_cache()
-        return jsonify({'todos': todo_cache})
+        if force_refresh:
+            with stage("refresh_email_cache"):
+                classify_thread = refresh_email_cache(force=True)
+            # The classification pass extracts action items once emails are tagged
+            with stage("classify_and_extract"):
+                if classify_thread:
+                    classify_thread.join()
+        return jsonify({'todos': todo_store.top(max_items=5)})
     except Exception as e:
         return jsonify({'error': f'Failed to retrieve todos: {e}'}), 500
 
 
+def check_admin_access():
+    """
+    Return an error response if profiling is disabled or the admin token doesn't match.
+    The endpoints stay closed until PROFILE_ADMIN_TOKEN is set, since CORS allows any origin.
+    """
+    if not request_profiler:
+        return jsonify({'error': 'Profiling is disabled (set PROFILE_REQUESTS=1)'}), 404
+    token = os.environ.get("PROFILE_ADMIN_TOKEN")
+    if not token:
+        return jsonify({'error': 'Admin endpoints are disabled (set PROFILE_ADMIN_TOKEN)'}), 403
+    provided = request.headers.get('X-Admin-Token', '')
+    if not hmac.compare_digest(provided.encode(), token.encode()):
+        return jsonify({'error': 'Unauthorized'}), 401
+    return None
+
+
+@app.route('/api/admin/profiles', methods=['GET'])
+def list_profiles():
+    """List captured slow-request profiles with their stage timings."""
+    error = check_admin_access()
+    if error:
+        return error
+    return jsonify({
+        'threshold_ms': request_profiler.threshold_ms,
+        'profiles': request_profiler.list_profiles()
+    })
+
+
+@app.route('/api/admin/profiles/<path:filename>', methods=['GET'])
+def download_profile(filename):
+    """Download a stored .json summary or .prof cProfile dump."""
+    error = check_admin_access()
+    if error:
+        return error
+    return send_from_directory(os.path.abspath(request_profiler.directory), filename, as_attachment=True)
+
+
 
 
 if __name__ == "__main__":
@@ -0,0 +1,178 @@
+# server/request_profiler.py
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import time
+import uuid
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+
+def _env_number(name, default, cast):
+    """Read a numeric environment variable, falling back to `default` if it is invalid."""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        print(f"Warning: invalid {name}={value!r}, using {default}")
+        return default
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a named stage of the current request.
+    Does nothing unless profiling is enabled.
+    """
+    if not has_request_context() or "profile_stages" not in g:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        g.profile_stages.append({"stage": name, "ms": round(elapsed_ms, 2)})
+
+
+class RequestProfiler:
+    def __init__(self, directory="profiles", threshold_ms=1000, max_profiles=50, sample_rate=0.1):
+        """
+        Time every request by stage and keep the ones slower than `threshold_ms`.
+        Only a `sample_rate` fraction of requests also runs under cProfile.
+        Only the newest `max_profiles` captures are kept in `directory`.
+        """
+        self.directory = directory
+        self.threshold_ms = threshold_ms
+        self.max_profiles = max_profiles
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+
+    @classmethod
+    def from_env(cls):
+        """Build a profiler from environment variables, or return None if disabled."""
+        if os.environ.get("PROFILE_REQUESTS", "").lower() not in ("1", "true", "yes"):
+            return None
+        return cls(
+            directory=os.environ.get("PROFILE_DIR", "profiles"),
+            threshold_ms=_env_number("PROFILE_THRESHOLD_MS", 1000, float),
+            max_profiles=_env_number("PROFILE_MAX_FILES", 50, int),
+            sample_rate=_env_number("PROFILE_SAMPLE_RATE", 0.1, float)
+        )
+
+    def init_app(self, app):
+        """Register request hooks on the Flask app."""
+        os.makedirs(self.directory, exist_ok=True)
+        app.before_request(self._start)
+        app.after_request(self._record_status)
+        # teardown runs even when a view raises, so the profiler is always disabled
+        app.teardown_request(self._finish)
+
+    def _start(self):
+        if request.path.startswith("/api/admin/"):
+            return
+        g.profile_stages = []
+        g.profile_start = time.perf_counter()
+        g.profiler = None
+        # cProfile adds overhead to every call, so only a sample of requests pays it
+        if random.random() >= self.sample_rate:
+            return
+        g.profiler = cProfile.Profile()
+        try:
+            g.profiler.enable()
+        except ValueError:
+            # On Python 3.12+ only one cProfile can be active per process, so this
+            # raises while another thread's request is profiled (3.11 is per-thread);
+            # stage timings are still recorded
+            g.profiler = None
+
+    def _record_status(self, response):
+        if "profile_start" in g:
+            g.profile_status = response.status_code
+        return response
+
+    def _finish(self, exc):
+        if "profile_start" not in g:
+            return
+
+        elapsed_ms = (time.perf_counter() - g.profile_start) * 1000
+        if g.profiler:
+            g.profiler.disable()
+
+        # after_request is skipped when an exception propagates (e.g. in debug mode)
+        status_code = 500 if exc is not None else g.get("profile_status", 500)
+        if elapsed_ms >= self.threshold_ms:
+            try:
+                self._save(elapsed_ms, status_code)
+            except Exception as e:
+                print(f"Error saving request profile: {e}")
+
+    def _save(self, elapsed_ms, status_code):
+        """Write the stage breakdown (.json) and cProfile stats (.prof) for a slow request."""
+        endpoint = re.sub(r"[^\w]+", "_", request.path).strip("_") or "root"
+        # One clock read keeps names sortable by time; the suffix avoids collisions
+        now = time.time()
+        timestamp = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}-{int(now * 1000) % 1000:03d}"
+        name = f"{timestamp}-{uuid.uuid4().hex[:6]}_{endpoint}"
+
+        top_functions = ""
+        if g.profiler:
+            g.profiler.dump_stats(os.path.join(self.directory, name + ".prof"))
+            out = io.StringIO()
+            pstats.Stats(g.profiler, stream=out).sort_stats("cumulative").print_stats(25)
+            top_functions = out.getvalue()
+
+        summary = {
+            "method": request.method,
+            "path": request.path,
+            "status": status_code,
+            "total_ms": round(elapsed_ms, 2),
+            "stages": g.profile_stages,
+            "top_functions": top_functions
+        }
+        with open(os.path.join(self.directory, name + ".json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+        print(f"Slow request {request.method} {request.path}: {elapsed_ms:.0f} ms (profile {name})")
+        self._rotate()
+
+    def _rotate(self):
+        """Delete the oldest captures beyond `max_profiles`."""
+        names = sorted({os.path.splitext(f)[0] for f in os.listdir(self.directory)})
+        for old in (names[:-self.max_profiles] if self.max_profiles > 0 else []):
+            for ext in (".json", ".prof"):
+                path = os.path.join(self.directory, old + ext)
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def list_profiles(self):
+        """Return the stage summaries of stored captures, newest first."""
+        profiles = []
+        for filename in sorted(os.listdir(self.directory), reverse=True):
+            if not filename.endswith(".json"):
+                continue
+            name = filename[:-len(".json")]
+            try:
+                with open(os.path.join(self.directory, filename), "r", encoding="utf-8") as f:
+                    summary = json.load(f)
+            except (OSError, ValueError):
+                # Rotated away or still being written by a concurrent request
+                continue
+            profiles.append({
+                "name": name,
+                "path": summary.get("path"),
+                "status": summary.get("status"),
+                "total_ms": summary.get("total_ms"),
+                "stages": summary.get("stages", []),
+                "files": [n for n in (name + ".json", name + ".prof")
+                          if os.path.exists(os.path.join(self.directory, n))]
+            })
+        return profiles
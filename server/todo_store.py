@@ -0,0 +1,149 @@
+# server/todo_store.py
+
+import json
+import os
+import re
+import threading
+import time
+
+# Higher rank = shown first when assembling the To-Do list
+TAG_PRIORITY = {
+    "urgent": 4,
+    "complaint": 3,
+    "business": 2,
+    "friendly": 1,
+    "default": 0
+}
+
+
+class TodoStore:
+    def __init__(self, path="todo_store.json", max_age_days=14, max_messages=200):
+        """
+        Persistent store of action items keyed by Gmail message id.
+        Each message is extracted once; the list is assembled locally.
+        Messages older than `max_age_days` are dropped, and at most the
+        newest `max_messages` are kept.
+        """
+        self.path = path
+        self.max_age_days = max_age_days
+        self.max_messages = max_messages
+        self.lock = threading.Lock()
+        self.messages = {}
+        self.load()
+
+    def load(self):
+        """Load previously extracted action items from disk, if any."""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.messages = json.load(f).get("messages", {})
+        except Exception as e:
+            print(f"Error loading To-Do store: {e}")
+            self.messages = {}
+
+    def save(self):
+        """Write the store to disk atomically."""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"messages": self.messages}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def pending(self, emails):
+        """Return the emails in the window whose action items have not been extracted yet."""
+        cutoff = self._cutoff()
+        with self.lock:
+            return [e for e in emails
+                    if e["id"] not in self.messages and int(e.get("date") or 0) >= cutoff]
+
+    def add(self, results):
+        """
+        Record extracted action items.
+        `results` is a list of (email, items) pairs; messages without
+        action items are stored with an empty list so they are skipped next time.
+        """
+        with self.lock:
+            for email, items in results:
+                self.messages[email["id"]] = {
+                    "sender": email.get("sender", ""),
+                    "subject": email.get("subject", ""),
+                    "date": int(email.get("date") or 0),
+                    "tag": email.get("tag", "default"),
+                    "is_spam": email.get("is_spam", False),
+                    "items": items
+                }
+            self._prune()
+            self.save()
+
+    def update_labels(self, emails):
+        """
+        Refresh the tag and spam flag of stored messages from newly classified emails.
+        """
+        with self.lock:
+            changed = False
+            for email in emails:
+                entry = self.messages.get(email["id"])
+                if not entry:
+                    continue
+                tag = email.get("tag", "default")
+                is_spam = email.get("is_spam", False)
+                if entry.get("tag") != tag or entry.get("is_spam") != is_spam:
+                    entry["tag"] = tag
+                    entry["is_spam"] = is_spam
+                    changed = True
+            if changed:
+                self.save()
+
+    def top(self, max_items=5):
+        """
+        Assemble the To-Do list without an LLM call:
+        drop spam and expired messages, de-duplicate by normalized text,
+        rank by tag then recency.
+        """
+        cutoff = self._cutoff()
+        with self.lock:
+            candidates = []
+            for message_id, entry in self.messages.items():
+                if entry.get("is_spam") or entry.get("tag") == "spam":
+                    continue
+                if entry.get("date", 0) < cutoff:
+                    continue
+                for item in entry["items"]:
+                    candidates.append((
+                        TAG_PRIORITY.get(entry.get("tag"), 0),
+                        entry.get("date", 0),
+                        item
+                    ))
+
+        candidates.sort(key=lambda c: (c[0], c[1]), reverse=True)
+
+        todos = []
+        seen = set()
+        for _, _, item in candidates:
+            key = self._normalize(item)
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            todos.append(item)
+            if len(todos) >= max_items:
+                break
+        return todos
+
+    def _cutoff(self):
+        """Oldest message date (Gmail internalDate, in ms) still in the window."""
+        return int((time.time() - self.max_age_days * 86400) * 1000)
+
+    def _prune(self):
+        """Drop expired messages and keep only the newest `max_messages`."""
+        cutoff = self._cutoff()
+        newest = sorted(
+            (item for item in self.messages.items() if item[1].get("date", 0) >= cutoff),
+            key=lambda item: item[1].get("date", 0),
+            reverse=True
+        )
+        self.messages = dict(newest[:self.max_messages])
+
+    def _normalize(self, text):
+        """Lowercase and strip numbering/punctuation for duplicate detection."""
+        text = re.sub(r"^\d+\.\s*", "", text.strip().lower())
+        return re.sub(r"[^\w\s]", "", re.sub(r"\s+", " ", text)).strip()